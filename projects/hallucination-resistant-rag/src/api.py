@@ -1,7 +1,11 @@
 from fastapi import FastAPI, HTTPException, File, UploadFile
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
+import asyncio
+import json
 import os
 import sys
 from pathlib import Path
@@ -13,21 +17,99 @@ PROJECT_ROOT = Path(__file__).parent.parent
 if str(PROJECT_ROOT) not in sys.path:
     sys.path.insert(0, str(PROJECT_ROOT))
 
-from src.main import runRAGSystem, runRAGForSingleFile
+from src.batching import batchLoop
+from src.embed import createEmbedding, encodeBatch
+from src.generate import generateAnswer, streamAnswer
+from src.main import (
+    DEFAULT_THRESHOLD,
+    NO_DOCUMENTS_MESSAGE,
+    hasDocuments,
+    loadIndex,
+    resolveChunks,
+    retrieveChunks,
+    runRAGForSingleFile,
+)
+from src.retrieve import WEB_CONCURRENCY, searchFaissBatch
 from src.upload import saveUploadedPdf, getSessionFiles, deleteSession
 
 app = FastAPI(title="Hallucination-Resistant RAG API")
 
-# Enable CORS for frontend access
+# Enable CORS for frontend access. Set CORS_ORIGINS (comma-separated) to
+# restrict origins; credentials are only allowed for explicit origins.
+corsOrigins = [o.strip() for o in os.getenv("CORS_ORIGINS", "*").split(",")]
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
+    allow_origins=corsOrigins,
+    allow_credentials="*" not in corsOrigins,
     allow_methods=["*"],
     allow_headers=["*"],
 )
 
 
+# Concurrent default-corpus searches arriving within this window are encoded
+# and searched together as one batch
+SEARCH_BATCH_WINDOW = 0.01
+SEARCH_BATCH_SIZE = 32
+TOP_K = 3
+
+
+@app.on_event("startup")
+async def warmStart():
+    """
+    Load the encoder and the default corpus index once per process so
+    requests do not pay the cold-start cost.
+    """
+    createEmbedding("warmup")
+    if hasDocuments():
+        await run_in_threadpool(loadIndex)
+
+    app.state.searchQueue = asyncio.Queue()
+    app.state.searchTask = asyncio.create_task(
+        searchBatchLoop(app.state.searchQueue)
+    )
+
+
+def searchDefaultCorpus(questions):
+    """
+    Encode a batch of questions and search the default index once.
+    loadIndex serves the index from its cache unless the documents changed.
+    """
+    index, metadata = loadIndex()
+    queryMatrix = encodeBatch(questions)
+    return searchFaissBatch(index, queryMatrix, metadata, TOP_K)
+
+
+async def searchBatchLoop(queue):
+    """
+    Collect (question, future) pairs for up to SEARCH_BATCH_WINDOW seconds and
+    resolve them with a single batched encode + search.
+    """
+    await batchLoop(
+        queue,
+        lambda questions: run_in_threadpool(searchDefaultCorpus, questions),
+        SEARCH_BATCH_WINDOW,
+        SEARCH_BATCH_SIZE,
+    )
+
+
+async def retrieve(query):
+    """
+    Retrieve (chunks, scores) for a query, or None if there are no documents.
+    Session-less queries go through the batched default-corpus search.
+    """
+    if query.session_id:
+        return await run_in_threadpool(
+            retrieveChunks, query.question, query.session_id, TOP_K
+        )
+    if not await run_in_threadpool(hasDocuments):
+        return None
+
+    future = asyncio.get_running_loop().create_future()
+    await app.state.searchQueue.put((query.question, future))
+    searchResults = await future
+    return await run_in_threadpool(resolveChunks, searchResults)
+
+
 class Query(BaseModel):
     question: str
     session_id: str
@@ -39,11 +121,53 @@ async def chat(query: Query):
         if not query.question.strip():
             raise HTTPException(status_code=400, detail="Question cannot be empty")
 
-        response = runRAGSystem(query.question, query.session_id)
+        # The RAG pipeline is blocking; keep it off the event loop
+        retrieved = await retrieve(query)
+        if retrieved is None:
+            response = NO_DOCUMENTS_MESSAGE
+        else:
+            retrievedChunks, similarityScores = retrieved
+            response = await run_in_threadpool(
+                generateAnswer,
+                query.question,
+                retrievedChunks,
+                similarityScores,
+                DEFAULT_THRESHOLD,
+            )
         return {"response": response}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/api/chat/stream")
+async def chat_stream(query: Query):
+    """
+    Same as /api/chat, but streams the answer as server-sent events, each
+    carrying a JSON {"text": ...} part, followed by a final [DONE] event.
+    """
+    if not query.question.strip():
+        raise HTTPException(status_code=400, detail="Question cannot be empty")
+
+    try:
+        retrieved = await retrieve(query)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+    async def events():
+        if retrieved is None:
+            yield f"data: {json.dumps({'text': NO_DOCUMENTS_MESSAGE})}\n\n"
+        else:
+            retrievedChunks, similarityScores = retrieved
+            async for part in streamAnswer(
+                query.question, retrievedChunks, similarityScores, DEFAULT_THRESHOLD
+            ):
+                yield f"data: {json.dumps({'text': part})}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
 
 @app.post("/api/upload")
 async def upload(file: UploadFile = File(...), session_id: str = None):
@@ -55,7 +179,7 @@ async def upload(file: UploadFile = File(...), session_id: str = None):
         session_id, file_path = await saveUploadedPdf(file, session_id)
         
         # Run RAG process for all files in the session
-        runRAGForSingleFile(session_id)
+        await run_in_threadpool(runRAGForSingleFile, session_id)
         
         # Get list of all files in session
         files = getSessionFiles(session_id)
@@ -86,7 +210,8 @@ async def list_session_files(session_id: str):
 async def delete_session_endpoint(session_id: str):
     """Delete a session and start fresh."""
     try:
-        success = deleteSession(session_id)
+        # Pruning the shared store walks every session; keep it off the event loop
+        success = await run_in_threadpool(deleteSession, session_id)
         if success:
             return {"message": "Session deleted successfully"}
         else:
@@ -110,5 +235,6 @@ if __name__ == "__main__":
         "src.api:app", 
         host="0.0.0.0", 
         port=8000,
-        reload=False
+        reload=False,
+        workers=WEB_CONCURRENCY,
     )
@@ -0,0 +1,106 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+
+
+def resolveFutures(futures, results=None, error=None):
+    """
+    Hand each future its result (or the shared error), skipping futures whose
+    caller has already given up (cancelled, e.g. on client disconnect).
+    """
+    for i, future in enumerate(futures):
+        try:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(results[i])
+        except (asyncio.InvalidStateError, InvalidStateError):
+            pass
+
+
+class QueryBatcher:
+    """
+    Coalesces concurrent single-text encode calls into one batched forward pass.
+    A background thread collects requests for up to timeout_ms (or until
+    batch_size are waiting) and encodes them together; callers block until
+    their own vector is ready.
+    """
+
+    def __init__(self, encodeFn, batch_size=32, timeout_ms=5):
+        self.encodeFn = encodeFn
+        self.batch_size = batch_size
+        self.timeout = timeout_ms / 1000
+        self.pending = []
+        self.condition = threading.Condition()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, text):
+        return self.submitAsync(text).result()
+
+    def submitAsync(self, text):
+        """
+        Queue a text and return the Future its vector will be set on.
+        """
+        future = Future()
+        with self.condition:
+            self.pending.append((text, future))
+            self.condition.notify()
+        return future
+
+    def _nextBatch(self):
+        with self.condition:
+            while not self.pending:
+                self.condition.wait()
+            deadline = time.monotonic() + self.timeout
+            while len(self.pending) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            batch = self.pending[: self.batch_size]
+            del self.pending[: self.batch_size]
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._nextBatch()
+            futures = [future for _, future in batch]
+            # A failing batch (or a cancelled caller) must never stop the thread
+            try:
+                vectors = self.encodeFn([text for text, _ in batch])
+                resolveFutures(futures, vectors)
+            except Exception as e:
+                resolveFutures(futures, error=e)
+
+
+async def batchLoop(queue, handler, window, batch_size):
+    """
+    Collect (item, future) pairs from an asyncio.Queue for up to window seconds
+    (or until batch_size are waiting) and resolve them with one
+    await handler(items) call, whose results are in item order.
+    Runs until cancelled.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await queue.get()]
+        deadline = loop.time() + window
+        while len(batch) < batch_size:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+
+        futures = [future for _, future in batch]
+        # One failing batch (or a cancelled waiter) must never end the loop,
+        # or every later request would wait forever
+        try:
+            results = await handler([item for item, _ in batch])
+            resolveFutures(futures, results)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            resolveFutures(futures, error=e)
@@ -1,4 +1,5 @@
-import re
+import json
+from pathlib import Path
 
 
 def chunkText(text, chunkSize=300, overlap=50):
@@ -6,19 +7,34 @@ def chunkText(text, chunkSize=300, overlap=50):
     Splits text into chunks with specified chunk size and overlap.
     """
 
-    # clean multiple spaces/newlines
-    text = re.sub(r"\s+", " ", text).strip()
-    words = text.split(" ")
+    # split() with no argument collapses all whitespace runs in one pass
+    words = text.split()
 
     # create chunks
-    chunks = []
-    start = 0
-    while start < len(words):
-        end = start + chunkSize
-        chunk = " ".join(words[start:end])
-        chunks.append(chunk)
-        start += chunkSize - overlap
-    return chunks
+    step = chunkSize - overlap
+    return [
+        " ".join(words[start : start + chunkSize])
+        for start in range(0, len(words), step)
+    ]
+
+
+def saveChunks(chunks, filename, chunks_dir):
+    """
+    Save the chunk list of a document as <chunks_dir>/<filename>.json.
+    """
+    with open(Path(chunks_dir) / f"{filename}.json", "w") as f:
+        json.dump(chunks, f)
+
+
+def loadChunks(filename, chunks_dir):
+    """
+    Load the chunk list saved by saveChunks, or None if it was never saved.
+    """
+    path = Path(chunks_dir) / f"{filename}.json"
+    if not path.exists():
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
 
 
 if __name__ == "__main__":
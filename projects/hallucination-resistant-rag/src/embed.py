@@ -1,36 +1,257 @@
+import os
+import shutil
+import tempfile
 from pathlib import Path
 
 import numpy as np
-from sentence_transformers import SentenceTransformer
+
+from src.batching import QueryBatcher
+
+try:
+    import onnxruntime as ort
+    from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    from transformers import AutoTokenizer
+except ImportError:
+    ort = None
+
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
 
 # Get the project root directory
 PROJECT_ROOT = Path(__file__).parent.parent
 
-model = SentenceTransformer("all-MiniLM-L6-v2")
+MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+ONNX_MODEL_DIR = PROJECT_ROOT / "models" / "all-MiniLM-L6-v2-int8"
+ONNX_MODEL_FILE = "model_quantized.onnx"
+
+
+def modelIsExported(model_dir=ONNX_MODEL_DIR):
+    """
+    True if model_dir holds both the quantized model and its tokenizer.
+    """
+    model_dir = Path(model_dir)
+    return (model_dir / ONNX_MODEL_FILE).exists() and (
+        model_dir / "tokenizer_config.json"
+    ).exists()
+
+
+def exportQuantizedModel(model_dir=ONNX_MODEL_DIR):
+    """
+    Export MiniLM to ONNX and apply dynamic int8 quantization (AVX512-VNNI).
+    The quantized model and tokenizer are written to a temp directory and
+    renamed to model_dir once complete, so other workers starting at the
+    same time never load a partial export. If one of them publishes first,
+    its export is kept.
+    """
+    model_dir = Path(model_dir)
+    model_dir.parent.mkdir(parents=True, exist_ok=True)
+    tmpDir = Path(tempfile.mkdtemp(dir=model_dir.parent, prefix=f".{model_dir.name}-"))
+    try:
+        onnxModel = ORTModelForFeatureExtraction.from_pretrained(
+            MODEL_NAME, export=True
+        )
+        quantizer = ORTQuantizer.from_pretrained(onnxModel)
+        quantizer.quantize(
+            save_dir=tmpDir,
+            quantization_config=AutoQuantizationConfig.avx512_vnni(
+                is_static=False, per_channel=False
+            ),
+        )
+        AutoTokenizer.from_pretrained(MODEL_NAME).save_pretrained(tmpDir)
+
+        if model_dir.exists() and not modelIsExported(model_dir):
+            # left behind by an export interrupted before this fix
+            shutil.rmtree(model_dir, ignore_errors=True)
+        try:
+            os.rename(tmpDir, model_dir)
+        except OSError:
+            if not modelIsExported(model_dir):
+                raise
+            return
+    finally:
+        shutil.rmtree(tmpDir, ignore_errors=True)
+    print(f"Exported int8 ONNX model to {model_dir}")
+
+
+def meanPool(hidden, attentionMask, normalize=True):
+    """
+    Mean-pool token embeddings over the attention mask, optionally L2-normalized.
+    hidden: (batch, tokens, dim), attentionMask: (batch, tokens)
+    """
+    if njit is not None:
+        return poolNorm(
+            np.ascontiguousarray(hidden, dtype=np.float32),
+            np.ascontiguousarray(attentionMask, dtype=np.int64),
+            normalize,
+        )
+
+    mask = attentionMask[:, :, None].astype(hidden.dtype)
+    vectors = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+    if normalize:
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.clip(norms, 1e-12, None)
+    return vectors
+
+
+if njit is not None:
+
+    @njit(parallel=True, fastmath=True, cache=True)
+    def poolNorm(hidden, mask, normalize):
+        """
+        Fused masked mean pooling + L2 normalization: one pass over the
+        hidden states per row instead of separate sum/divide/norm passes.
+        """
+        batch, tokens, dim = hidden.shape
+        out = np.zeros((batch, dim), dtype=np.float32)
+        for b in prange(batch):
+            count = 0.0
+            for t in range(tokens):
+                if mask[b, t]:
+                    count += 1.0
+                    for h in range(dim):
+                        out[b, h] += hidden[b, t, h]
+
+            scale = 1.0 / max(count, 1e-9)
+            if normalize:
+                sq = 0.0
+                for h in range(dim):
+                    sq += out[b, h] * out[b, h]
+                # norm of the mean = norm of the sum * scale, so scale cancels
+                scale = 1.0 / max(np.sqrt(sq), 1e-12)
+            for h in range(dim):
+                out[b, h] *= scale
+        return out
+
+
+class Encoder:
+    """
+    int8 ONNX Runtime encoder for all-MiniLM-L6-v2.
+    Implements the subset of SentenceTransformer.encode used by this project.
+    """
+
+    def __init__(self, model_dir=ONNX_MODEL_DIR, max_length=256):
+        model_dir = Path(model_dir)
+        if not modelIsExported(model_dir):
+            exportQuantizedModel(model_dir)
+
+        self.max_length = max_length
+        self.tokenizer = AutoTokenizer.from_pretrained(str(model_dir))
+        self.session = ort.InferenceSession(
+            str(model_dir / ONNX_MODEL_FILE), providers=["CPUExecutionProvider"]
+        )
+        self.inputNames = {i.name for i in self.session.get_inputs()}
+        self.dim = self.session.get_outputs()[0].shape[-1]
+
+    def encode(
+        self,
+        texts,
+        batch_size=64,
+        show_progress_bar=False,
+        convert_to_numpy=True,
+        normalize_embeddings=False,
+    ):
+        single = isinstance(texts, str)
+        if single:
+            texts = [texts]
+
+        batches = []
+        for start in range(0, len(texts), batch_size):
+            tokens = self.tokenizer(
+                texts[start : start + batch_size],
+                padding=True,
+                truncation=True,
+                max_length=self.max_length,
+                return_tensors="np",
+            )
+            feed = {
+                name: value.astype(np.int64)
+                for name, value in tokens.items()
+                if name in self.inputNames
+            }
+            hidden = self.session.run(None, feed)[0]
+            batches.append(
+                meanPool(hidden, tokens["attention_mask"], normalize_embeddings)
+            )
+
+        if batches:
+            vectors = np.concatenate(batches).astype(np.float32)
+        else:
+            vectors = np.empty((0, self.dim), dtype=np.float32)
+        return vectors[0] if single else vectors
+
+
+def cudaAvailable():
+    try:
+        import torch
+    except ImportError:
+        return False
+    return torch.cuda.is_available()
+
+
+if cudaAvailable():
+    # On GPU the PyTorch model beats the CPU-only int8 ONNX encoder
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer("all-MiniLM-L6-v2", device="cuda")
+elif ort is not None:
+    model = Encoder()
+else:
+    # optimum/onnxruntime not installed: fall back to the FP32 PyTorch model
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer("all-MiniLM-L6-v2", device="cpu")
+
+
+def encodeBatch(texts, batch_size=64):
+    """
+    Encode a list of texts into a (len(texts), dim) matrix of unit-length vectors.
+    """
+    return model.encode(
+        texts,
+        batch_size=batch_size,
+        show_progress_bar=False,
+        convert_to_numpy=True,
+        normalize_embeddings=True,
+    )
+
+
+queryBatcher = QueryBatcher(encodeBatch)
 
 
 def createEmbedding(text: str):
     """
     Convert input text into a numerical embedding.
+    Concurrent calls are batched into a single model forward pass.
     """
-    embedding = model.encode(text)
-    return embedding
+    return queryBatcher.submit(text)
 
 
-def embedChunks(chunks, filename, embeddings_dir):
+def embedChunks(chunks, filename, embeddings_dir, batch_size=64):
     """
-    Generate embeddings for a list of text chunks.
-    Save each embedding as a .npy file in the specified embeddings directory.
+    Generate embeddings for a list of text chunks in batches.
+    Saves all vectors as a single (nchunks, dim) float16 vectors.npy matrix
+    whose row i is the embedding of chunk i.
     """
+    if not chunks:
+        print(f"No text to embed for {filename}")
+        return
+
     folderPath = Path(embeddings_dir) / filename
     folderPath.mkdir(parents=True, exist_ok=True)
 
-    for i, chunk in enumerate(chunks):
-        vector = createEmbedding(chunk)
-        np.save(str(folderPath / f"chunk_{i}.npy"), vector)
+    vectors = encodeBatch(chunks, batch_size=batch_size)
+    # float16 on disk halves the bytes read when building the index. Write to
+    # a temp file and rename so readers never load a half-written matrix
+    fd, tmpPath = tempfile.mkstemp(dir=folderPath, suffix=".npy.tmp")
+    with os.fdopen(fd, "wb") as f:
+        np.save(f, vectors.astype(np.float16))
+    os.replace(tmpPath, folderPath / "vectors.npy")
     print(f"Generated {len(chunks)} embeddings for {filename}")
 
 
 if __name__ == "__main__":
     sampleChunks = ["This is a test chunk.", "Another test chunk."]
-    embedChunks(sampleChunks, "sampleDoc")
+    embedChunks(sampleChunks, "sampleDoc", PROJECT_ROOT / "embeddings")
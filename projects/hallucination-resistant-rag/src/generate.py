@@ -1,13 +1,13 @@
-from src.decision import calculateConfidence, generateRefusalMessage
+from src.decision import DEFAULT_THRESHOLD, calculateConfidence, generateRefusalMessage
 from src.llm import generateAnswer as generateLlmAnswer
+from src.llm import streamAnswer as streamLlmAnswer
 
 
-
-def generateAnswer(question, retrievedChunks, similarityScores, threshold=0.4):
+def generateAnswer(question, retrievedChunks, similarityScores, threshold=DEFAULT_THRESHOLD):
     """
     Generates an answer if confident, otherwise refuses.
     retrievedChunks: list of text chunks
-    similarityScores: distances from FAISS
+    similarityScores: cosine similarities from FAISS
     """
 
     # Step 1: Confidence gate (authoritative)
@@ -16,12 +16,7 @@ def generateAnswer(question, retrievedChunks, similarityScores, threshold=0.4):
         return generateRefusalMessage()
 
     # Step 2: Prepare context for LLM (controlled)
-    contextChunks = []
-    for i, chunk in enumerate(retrievedChunks):
-        contextChunks.append({
-            "id": f"Source {i+1}",
-            "text": chunk.strip()
-        })
+    contextChunks = prepareContext(retrievedChunks)
 
     # Step 3: LLM generation (non-authoritative)
     answer = generateLlmAnswer(
@@ -32,11 +27,43 @@ def generateAnswer(question, retrievedChunks, similarityScores, threshold=0.4):
     return answer
 
 
+async def streamAnswer(question, retrievedChunks, similarityScores, threshold=DEFAULT_THRESHOLD):
+    """
+    Streaming version of generateAnswer: yields the answer text in parts.
+    """
+
+    # Step 1: Confidence gate (authoritative)
+    confident, score = calculateConfidence(similarityScores, threshold)
+    if not confident:
+        yield generateRefusalMessage()
+        return
+
+    # Step 2: LLM generation (non-authoritative), streamed
+    async for part in streamLlmAnswer(
+        contextChunks=prepareContext(retrievedChunks),
+        question=question
+    ):
+        yield part
+
+
+def prepareContext(retrievedChunks):
+    """
+    Label retrieved chunks as sources for the LLM prompt.
+    """
+    contextChunks = []
+    for i, chunk in enumerate(retrievedChunks):
+        contextChunks.append({
+            "id": f"Source {i+1}",
+            "text": chunk.strip()
+        })
+    return contextChunks
+
+
 if __name__ == "__main__":
     # Example test
     testChunks = ["Chunk 1 content about AI.", "Chunk 2 content about RAG."]
-    testDistances = [0.1, 0.2]  # example similarity distances
+    testScores = [0.8, 0.7]  # example cosine similarities
     question = "What is hallucination-resistant RAG?"
 
-    answer = generateAnswer(question, testChunks, testDistances)
+    answer = generateAnswer(question, testChunks, testScores)
     print(answer)
@@ -1,7 +1,16 @@
+import hashlib
+import multiprocessing
 import os
+from concurrent.futures import ProcessPoolExecutor
 
 import pdfplumber
 
+# The API calls ingestDocuments from a threaded process; forking it could copy
+# locks held by other threads into the workers, so start them fresh instead
+_START_METHOD = (
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+
 
 def extractTextFromPdf(file_path: str) -> str:
     """
@@ -14,17 +23,37 @@ def extractTextFromPdf(file_path: str) -> str:
     return text
 
 
-def ingestDocuments(folder_path: str) -> dict:
+def fileSha256(file_path: str) -> str:
+    """
+    Returns the SHA-256 hex digest of a file's contents.
     """
-    Reads all PDFs in a folder and returns a dictionary:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def ingestDocuments(folder_path: str, filenames=None) -> dict:
+    """
+    Reads all PDFs in a folder (or only the given filenames) and returns a
+    dictionary:
     { filename: text }
     """
-    documents = {}
-    for filename in os.listdir(folder_path):
-        if filename.endswith(".pdf"):
-            path = os.path.join(folder_path, filename)
-            documents[filename] = extractTextFromPdf(path)
-    return documents
+    if filenames is None:
+        filenames = [f for f in os.listdir(folder_path) if f.endswith(".pdf")]
+    paths = [os.path.join(folder_path, f) for f in filenames]
+
+    # PDF parsing is CPU-bound; only pay the pool start-up cost for several files
+    if len(paths) > 1:
+        workers = min(len(paths), os.cpu_count() or 1)
+        context = multiprocessing.get_context(_START_METHOD)
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            texts = list(executor.map(extractTextFromPdf, paths))
+    else:
+        texts = [extractTextFromPdf(path) for path in paths]
+
+    return dict(zip(filenames, texts))
 
 
 if __name__ == "__main__":
@@ -1,5 +1,10 @@
+import functools
+import json
 import os
+import shutil
 import sys
+import threading
+from collections import OrderedDict
 from pathlib import Path
 
 # Get the project root directory (parent of src/)
@@ -9,84 +14,330 @@ PROJECT_ROOT = Path(__file__).parent.parent
 if str(PROJECT_ROOT) not in sys.path:
     sys.path.insert(0, str(PROJECT_ROOT))
 
-from src.chunk import chunkText
+from src.chunk import chunkText, loadChunks, saveChunks
+from src.decision import DEFAULT_THRESHOLD
 from src.embed import createEmbedding, embedChunks
 from src.generate import generateAnswer
-from src.ingest import ingestDocuments
-from src.retrieve import buildFaissIndex, searchFaiss
+from src.ingest import extractTextFromPdf, fileSha256, ingestDocuments
+from src.retrieve import (
+    METADATA_FILE,
+    buildFaissIndex,
+    indexIsFresh,
+    loadFaissIndex,
+    saveFaissIndex,
+    searchFaiss,
+    toGpu,
+)
+from src.store import (
+    EMBEDDINGS_STORE,
+    linkEmbeddings,
+    newStoreEntry,
+    pruneStore,
+    publishStoreEntry,
+)
 
+NO_DOCUMENTS_MESSAGE = "No documents found. Please upload a PDF."
 
-def runRAGForSingleFile(session_id: str):
+# LRU of loaded indexes: index_dir -> (index, metadata, metadata file mtime)
+INDEX_CACHE_SIZE = 32
+_indexCache = OrderedDict()
+_indexCacheLock = threading.Lock()
+
+# One lock per index_dir, serializing embedding and re-indexing a corpus
+# between uploads and the chats that find its documents changed
+_syncLocks = {}
+_syncLocksLock = threading.Lock()
+
+
+def getPaths(session_id=None):
     """
-    Processes a single uploaded PDF file for a given session.
+    Resolve the (docs_folder, embeddings_root, index_dir) used for a session,
+    or for the default data/documents corpus.
+    embeddings_root/<file name> holds a document's vectors.npy and chunks.json.
     """
-    session_dir = PROJECT_ROOT / "data" / "sessions" / session_id
-    uploads_dir = session_dir / "uploads"
-    embeddings_dir = session_dir / "embeddings"
-    chunks_dir = session_dir / "chunks"
-    index_dir = session_dir / "index"
+    if session_id:
+        session_dir = PROJECT_ROOT / "data" / "sessions" / session_id
+        return (
+            session_dir / "uploads",
+            session_dir / "embeddings",
+            session_dir / "index",
+        )
 
-    for d in [embeddings_dir, chunks_dir, index_dir]:
-        d.mkdir(exist_ok=True)
+    embeddings_root = PROJECT_ROOT / "embeddings"
+    # Default corpus keeps its index alongside the embeddings
+    return (
+        PROJECT_ROOT / "data" / "documents",
+        embeddings_root,
+        embeddings_root,
+    )
 
-    # Ingest the document
-    documents = ingestDocuments(str(uploads_dir))
-    if not documents:
-        raise Exception("No document found in the session's upload directory.")
 
-    # Chunk and embed
+def syncLock(index_dir):
+    """
+    The lock that serializes syncing and re-indexing the corpus in index_dir.
+    """
+    with _syncLocksLock:
+        return _syncLocks.setdefault(str(index_dir), threading.Lock())
+
+
+def syncEmbeddings(docs_folder, embeddings_dir):
+    """
+    Link embeddings_dir/<file name> to the store entry of every PDF in
+    docs_folder, embedding only content that is not in the store yet, and
+    drop the entries of PDFs that are gone.
+    """
+    embeddings_dir.mkdir(parents=True, exist_ok=True)
+    fileNames = [f for f in os.listdir(docs_folder) if f.endswith(".pdf")]
+
+    # Key embeddings by file content so unchanged or re-uploaded PDFs are
+    # neither re-parsed nor re-embedded
+    hashes = {f: fileSha256(str(docs_folder / f)) for f in fileNames}
+    # chunks.json is in every published entry; vectors.npy is missing for
+    # PDFs without any text
+    pending = [
+        f
+        for f in fileNames
+        if not (EMBEDDINGS_STORE / hashes[f] / "chunks.json").exists()
+    ]
+
+    # Ingest, chunk and embed new content
+    documents = ingestDocuments(str(docs_folder), pending) if pending else {}
     for file_name, text in documents.items():
+        # Written privately, then published in one rename
+        entryDir = newStoreEntry(hashes[file_name])
+        with open(entryDir / "meta.json", "w") as f:
+            json.dump({"file_name": file_name, "sha256": hashes[file_name]}, f)
+
         chunk_list = chunkText(text)
-        embedChunks(chunk_list, file_name, embeddings_dir)
+        saveChunks(chunk_list, "chunks", entryDir)
+        embedChunks(chunk_list, entryDir.name, EMBEDDINGS_STORE)
+        publishStoreEntry(entryDir, hashes[file_name])
+        # Link right away: pruneStore treats unlinked entries as garbage
+        linkEmbeddings(embeddings_dir / file_name, EMBEDDINGS_STORE / hashes[file_name])
 
-    # Build FAISS index
-    buildFaissIndex(str(embeddings_dir), str(index_dir))
+    # Documents that were already in the store (no-op for those just linked)
+    for file_name in fileNames:
+        storeDir = EMBEDDINGS_STORE / hashes[file_name]
+        linkEmbeddings(embeddings_dir / file_name, storeDir)
 
+    # Links of removed PDFs, and per-file directories of the old layout
+    # (chunk_*.npy files) whose PDFs are gone
+    for entry in os.scandir(embeddings_dir):
+        if entry.name in hashes:
+            continue
+        if entry.is_symlink():
+            os.unlink(entry.path)
+        elif entry.is_dir():
+            shutil.rmtree(entry.path)
 
-def runRAGSystem(question, session_id=None, threshold=0.25, topK=3):
-    if session_id:
-        session_dir = PROJECT_ROOT / "data" / "sessions" / session_id
-        docs_folder = str(session_dir / "uploads")
-        embeddings_root = session_dir / "embeddings"
-        index_dir = session_dir / "index"
+    pruneStore()
+
+
+def embeddingsOutdated(docs_folder, embeddings_root, index_dir):
+    """
+    Stat-only check whether syncEmbeddings has work to do: a PDF without a
+    store entry (new, or still in the old chunk_*.npy layout), a PDF modified
+    since the index was saved, or an entry left for a removed PDF.
+    """
+    fileNames = {f for f in os.listdir(docs_folder) if f.endswith(".pdf")}
+    metadataFile = index_dir / METADATA_FILE
+    savedAt = metadataFile.stat().st_mtime if metadataFile.exists() else None
+
+    for f in fileNames:
+        if not (embeddings_root / f / "chunks.json").exists():
+            return True
+        if savedAt is None or (docs_folder / f).stat().st_mtime > savedAt:
+            return True
+
+    if not embeddings_root.is_dir():
+        return bool(fileNames)
+    # Dot names are links still being created by linkEmbeddings
+    entries = {
+        e.name
+        for e in os.scandir(embeddings_root)
+        if not e.name.startswith(".") and (e.is_symlink() or e.is_dir())
+    }
+    return entries != fileNames
+
+
+def runRAGForSingleFile(session_id: str):
+    """
+    Processes the uploaded PDFs of a session, embedding only files whose
+    content has not been embedded before, then rebuilds the session index.
+    """
+    uploads_dir, embeddings_dir, index_dir = getPaths(session_id)
+    index_dir.mkdir(exist_ok=True)
+
+    if not any(f.endswith(".pdf") for f in os.listdir(uploads_dir)):
+        raise Exception("No document found in the session's upload directory.")
+
+    # A chat arriving mid-upload would otherwise embed the same PDFs again
+    with syncLock(index_dir):
+        syncEmbeddings(uploads_dir, embeddings_dir)
+
+        # Build FAISS index once at ingest time
+        index, metadata = buildFaissIndex(str(embeddings_dir))
+        saveFaissIndex(index, metadata, str(index_dir))
+
+
+def hasDocuments(session_id=None):
+    """
+    True if the session (or the default corpus) has any PDF to search.
+    """
+    docs_folder = getPaths(session_id)[0]
+    return docs_folder.exists() and any(
+        f.endswith(".pdf") for f in os.listdir(docs_folder)
+    )
+
+
+def loadIndex(session_id=None):
+    """
+    Load the saved FAISS index for a session (or the default corpus), embedding
+    new documents and rebuilding only if the documents or embeddings changed.
+    Returns (index, metadata), with the index moved to GPU when available.
+    Indexes stay cached in-process until their saved files change.
+    """
+    docs_folder, embeddings_root, index_dir = getPaths(session_id)
+    key = str(index_dir)
+
+    # Embed documents added to or changed in the folder since the last load
+    # (the default corpus has no upload step that would do it)
+    if embeddingsOutdated(docs_folder, embeddings_root, index_dir):
+        with syncLock(index_dir):
+            if embeddingsOutdated(docs_folder, embeddings_root, index_dir):
+                syncEmbeddings(docs_folder, embeddings_root)
+
+    if indexIsFresh(str(embeddings_root), key):
+        stamp = os.path.getmtime(index_dir / METADATA_FILE)
+        with _indexCacheLock:
+            cached = _indexCache.get(key)
+            if cached is not None and cached[2] == stamp:
+                _indexCache.move_to_end(key)
+                return cached[0], cached[1]
+        index, metadata = loadFaissIndex(key)
     else:
-        # Default behavior
-        docs_folder = str(PROJECT_ROOT / "data" / "documents")
-        embeddings_root = PROJECT_ROOT / "embeddings"
-        index_dir = embeddings_root  # Assuming index is stored with embeddings
-
-    # Step 1: Ingest documents (to get text for context)
-    documents = ingestDocuments(docs_folder)
-    if not documents:
-        return "No documents found. Please upload a PDF."
-
-    # Step 2: Build FAISS index path
-    faiss_index_path = index_dir
-    if not session_id:
-        # Compatibility with old structure
         index, metadata = buildFaissIndex(str(embeddings_root))
-    else:
-        index, metadata = buildFaissIndex(str(embeddings_root), str(faiss_index_path))
+        saveFaissIndex(index, metadata, key)
+        stamp = os.path.getmtime(index_dir / METADATA_FILE)
+
+    index = toGpu(index)
+    with _indexCacheLock:
+        _indexCache[key] = (index, metadata, stamp)
+        _indexCache.move_to_end(key)
+        while len(_indexCache) > INDEX_CACHE_SIZE:
+            _indexCache.popitem(last=False)
+    return index, metadata
+
+
+def loadDocumentChunks(fileName, session_id=None):
+    """
+    Load the chunks saved for a document at ingest time, falling back to
+    extracting and chunking the PDF if no cache exists.
+    Both are cached across queries, keyed by file identity rather than content
+    so a lookup costs one stat instead of reading the file.
+    """
+    docs_folder, embeddings_root, _ = getPaths(session_id)
+    entryDir = embeddings_root / fileName
+    try:
+        stat = (entryDir / "chunks.json").stat()
+    except FileNotFoundError:
+        path = docs_folder / fileName
+        stat = path.stat()
+        return chunkPdf(str(path), stat.st_mtime_ns, stat.st_size)
+
+    # Store entries are immutable and content-addressed, so the resolved
+    # entry path (which contains the sha) identifies their chunks
+    return savedChunks(os.path.realpath(entryDir), stat.st_mtime_ns, stat.st_size)
+
+
+@functools.lru_cache(maxsize=128)
+def savedChunks(entryDir, mtime_ns, size):
+    """
+    Load the chunks saved in an embeddings entry, cached per (entry, mtime, size).
+    """
+    return tuple(loadChunks("chunks", entryDir))
 
-    # Step 3: Create embedding for user question
+
+@functools.lru_cache(maxsize=128)
+def chunkPdf(path, mtime_ns, size):
+    """
+    Extract and chunk a PDF, cached per (path, mtime, size) so documents
+    without saved chunks are only parsed once per process.
+    """
+    return tuple(chunkText(extractTextFromPdf(path)))
+
+
+def retrieveChunks(
+    question,
+    session_id=None,
+    topK=3,
+    index=None,
+    metadata=None,
+    chunksByFile=None,
+):
+    """
+    Retrieve the topK chunks for a question from a session's documents (or the
+    default corpus). A preloaded index/metadata and chunksByFile dict can be
+    passed in to skip loading them from disk.
+    Returns (retrievedChunks, similarityScores), or None if there are no documents.
+    """
+    # Step 1: Load the FAISS index unless the caller preloaded it
+    if index is None:
+        if not hasDocuments(session_id):
+            return None
+        index, metadata = loadIndex(session_id)
+
+    # Step 2: Create embedding for user question
     queryVector = createEmbedding(question)
 
-    # Step 4: Retrieve topK chunks
+    # Step 3: Retrieve topK chunks
     searchResults = searchFaiss(index, queryVector, metadata, topK=topK)
 
-    # Step 5: Extract retrieved chunks and similarity scores
+    # Step 4: Extract retrieved chunks and similarity scores
+    return resolveChunks(searchResults, session_id, chunksByFile)
+
+
+def resolveChunks(searchResults, session_id=None, chunksByFile=None):
+    """
+    Map (fileName, chunkIndex, score) search results to their chunk texts.
+    Returns (retrievedChunks, similarityScores).
+    """
+    if chunksByFile is None:
+        chunksByFile = {}
+    for fileName in {result[0] for result in searchResults}:
+        if fileName not in chunksByFile:
+            chunksByFile[fileName] = loadDocumentChunks(fileName, session_id)
+
     retrievedChunks = []
     similarityScores = []
-    for fileName, chunkId, distance in searchResults:
-        # Use cached text from ingestion step
-        text = documents[fileName]
-        # Map chunkId back to text chunk
-        chunkNum = int(chunkId.split("_")[1].split(".")[0])
-        chunkList = chunkText(text)
-        retrievedChunks.append(chunkList[chunkNum])
-        similarityScores.append(distance)
-
-    # Step 6: Generate answer or refusal
+    for fileName, chunkIndex, score in searchResults:
+        retrievedChunks.append(chunksByFile[fileName][chunkIndex])
+        similarityScores.append(score)
+    return retrievedChunks, similarityScores
+
+
+def runRAGSystem(
+    question,
+    session_id=None,
+    threshold=DEFAULT_THRESHOLD,
+    topK=3,
+    index=None,
+    metadata=None,
+    chunksByFile=None,
+):
+    """
+    Answer a question from a session's documents (or the default corpus).
+    index, metadata and chunksByFile are optional preloaded state (see
+    retrieveChunks).
+    """
+    retrieved = retrieveChunks(
+        question, session_id, topK, index, metadata, chunksByFile
+    )
+    if retrieved is None:
+        return NO_DOCUMENTS_MESSAGE
+
+    # Generate answer or refusal
+    retrievedChunks, similarityScores = retrieved
     answer = generateAnswer(question, retrievedChunks, similarityScores, threshold)
     return answer
 
@@ -1,71 +1,385 @@
+import functools
+import math
 import os
-import json
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
 import faiss
 import numpy as np
 
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
+INDEX_FILE = "index.faiss"
+METADATA_FILE = "metadata.npz"
+
+# Vectors are stored as fp16 (half the bytes scanned per query of float32);
+# QT_8bit quarters them at a small recall cost
+SCALAR_QUANTIZER = faiss.ScalarQuantizer.QT_fp16
+
+# HNSW graph parameters (neighbours per node, build/search beam widths)
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 128
+HNSW_EF_SEARCH = 64
+
+# Below this size an exact scan is cheaper than building an HNSW graph
+HNSW_MIN_VECTORS = 1000
+
+# Corpora at least this large use a trained, compressed OPQ+IVF-PQ index
+# (M bytes per vector instead of 4 * dim)
+IVFPQ_MIN_VECTORS = 50000
+IVFPQ_MAX_SUBQUANTIZERS = 64
+IVFPQ_NPROBE = 16
 
-def buildFaissIndex(embeddingFolder, index_dir=None):
+# Below this size a brute-force scan beats the FAISS call overhead
+SMALL_INDEX_VECTORS = 512
+
+# GPU search only pays off for large indexes; small ones and one-at-a-time
+# queries are faster on CPU. FAISS_USE_GPU=0 disables it entirely.
+FAISS_USE_GPU = os.getenv("FAISS_USE_GPU", "1") != "0"
+GPU_MIN_VECTORS = int(os.getenv("FAISS_GPU_MIN_VECTORS", "100000"))
+
+_gpuResources = None
+
+
+def positiveIntEnv(name, default):
     """
-    Build a FAISS index from all .npy embeddings in the given folder.
-    Saves the index and metadata, or loads them if they already exist.
+    Read a count from the environment, falling back to default when it is
+    unset or not an integer, and clamping it to at least 1.
     """
-    if index_dir is None:
-        index_dir = embeddingFolder
+    value = os.getenv(name, "").strip()
+    if not value:
+        return max(1, default)
+    try:
+        return max(1, int(value))
+    except ValueError:
+        print(f"Ignoring {name}={value!r}: not an integer")
+        return max(1, default)
 
-    index_file = os.path.join(index_dir, "faiss_index.bin")
-    metadata_file = os.path.join(index_dir, "metadata.json")
 
-    if os.path.exists(index_file) and os.path.exists(metadata_file):
-        print(f"Loading existing index from {index_dir}")
-        index = faiss.read_index(index_file)
-        with open(metadata_file, "r") as f:
-            metadata = json.load(f)
-        return index, metadata
+# Split the cores between uvicorn workers so their OpenMP pools do not
+# oversubscribe the machine; FAISS_NUM_THREADS overrides the split
+WEB_CONCURRENCY = positiveIntEnv("WEB_CONCURRENCY", 1)
+FAISS_NUM_THREADS = positiveIntEnv(
+    "FAISS_NUM_THREADS", (os.cpu_count() or 1) // WEB_CONCURRENCY
+)
+faiss.omp_set_num_threads(FAISS_NUM_THREADS)
 
-    vectors = []
-    metadata = []
 
-    for fileName in os.listdir(embeddingFolder):
-        filePath = os.path.join(embeddingFolder, fileName)
-        if os.path.isdir(filePath):
-            for chunkFile in os.listdir(filePath):
-                if chunkFile.endswith(".npy"):
-                    vector = np.load(os.path.join(filePath, chunkFile))
-                    if vector.ndim == 1:
-                        vectors.append(vector)
-                        metadata.append((fileName, chunkFile))
-                    else:
-                        print(f"Skipping invalid vector: {fileName}/{chunkFile}")
-
-    if not vectors:
-        raise ValueError("No embeddings found in embeddings folder!")
+def toGpu(index):
+    """
+    Move an index of at least GPU_MIN_VECTORS vectors to GPU 0 when enabled,
+    FAISS has GPU support and the index type can run there; otherwise return
+    it unchanged. Save the CPU index, not this one.
+    """
+    global _gpuResources
+    if not FAISS_USE_GPU or index.ntotal < GPU_MIN_VECTORS:
+        return index
+    if not hasattr(faiss, "StandardGpuResources") or faiss.get_num_gpus() == 0:
+        return index
+
+    # fp16 lookup tables are needed for PQ codes of more than 48 bytes
+    options = faiss.GpuClonerOptions()
+    options.useFloat16 = True
+
+    try:
+        if _gpuResources is None:
+            _gpuResources = faiss.StandardGpuResources()
+        return faiss.index_cpu_to_gpu(_gpuResources, 0, index, options)
+    except Exception as e:
+        # e.g. HNSW indexes have no GPU implementation
+        print(f"Keeping index on CPU: {e}")
+        return index
+
+
+def ivfpqFactory(numVectors, dim):
+    """
+    index_factory string for an OPQ+IVF-PQ index sized to the corpus:
+    about 4 * sqrt(N) inverted lists and up to 64 one-byte sub-quantizers
+    (M must divide dim).
+    """
+    nlist = int(4 * math.sqrt(numVectors))
+    m = min(dim // 4, IVFPQ_MAX_SUBQUANTIZERS)
+    while dim % m:
+        m -= 1
+    return f"OPQ{m},IVF{nlist},PQ{m}x8"
+
 
-    vectors = np.stack(vectors).astype("float32")
+def createIndex(vectors):
+    """
+    Create and populate an inner-product FAISS index for normalized vectors.
+    Uses an exact scan for small corpora, HNSW over scalar-quantized storage
+    for medium ones and OPQ+IVF-PQ for large ones.
+    """
     dim = vectors.shape[1]
 
-    index = faiss.IndexFlatL2(dim)
+    if len(vectors) >= IVFPQ_MIN_VECTORS:
+        factory = ivfpqFactory(len(vectors), dim)
+        index = faiss.index_factory(dim, factory, faiss.METRIC_INNER_PRODUCT)
+    elif len(vectors) < HNSW_MIN_VECTORS:
+        index = faiss.IndexScalarQuantizer(
+            dim, SCALAR_QUANTIZER, faiss.METRIC_INNER_PRODUCT
+        )
+    else:
+        index = faiss.IndexHNSWSQ(
+            dim, SCALAR_QUANTIZER, HNSW_M, faiss.METRIC_INNER_PRODUCT
+        )
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+
+    index.train(vectors)
     index.add(vectors)
+    setSearchDefaults(index)
+    return index
+
+
+def setSearchDefaults(index):
+    """
+    Set the search-time knobs (HNSW efSearch, IVF nprobe) of an index once,
+    before it is shared between threads. Searches never change them; a
+    larger beam is passed per call through SearchParameters instead.
+    """
+    if hasattr(index, "hnsw"):
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+    # Also covers GPU search: GPU IVF indexes are not IndexIVF subclasses, but
+    # toGpu's clone copies nprobe from the CPU index
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = IVFPQ_NPROBE
+
+
+def dedupeVectors(vectors, metadata):
+    """
+    Drop byte-identical vectors (e.g. the same PDF uploaded under two names),
+    keeping the first occurrence and its metadata entry.
+    """
+    # View each row as one opaque value so np.unique compares whole rows
+    rows = np.ascontiguousarray(vectors).view(
+        np.dtype((np.void, vectors.dtype.itemsize * vectors.shape[1]))
+    )
+    _, first = np.unique(rows.ravel(), return_index=True)
+    if len(first) == len(vectors):
+        return vectors, metadata
+
+    keep = np.sort(first)
+    print(f"Removed {len(vectors) - len(keep)} of {len(vectors)} duplicate vectors")
+    return vectors[keep], {key: values[keep] for key, values in metadata.items()}
+
+
+def buildFaissIndex(embeddingFolder):
+    """
+    Build a FAISS index from the per-document vectors.npy matrices in the given folder.
+    Returns (index, metadata) where metadata["files"][i] and metadata["chunks"][i]
+    are the file name and chunk index of vector i.
+    """
+    fileNames = []
+    matrices = []
+
+    for fileName in sorted(os.listdir(embeddingFolder)):
+        # skip links that are still being created (see store.linkEmbeddings)
+        if fileName.startswith("."):
+            continue
+        vectorFile = os.path.join(embeddingFolder, fileName, "vectors.npy")
+        if not os.path.isfile(vectorFile):
+            continue
+
+        fileNames.append(fileName)
+        matrices.append(np.load(vectorFile, mmap_mode="r"))
+
+    if not matrices:
+        raise ValueError("No embeddings found in embeddings folder!")
+
+    counts = [len(matrix) for matrix in matrices]
+    metadata = {
+        "files": np.repeat(np.array(fileNames), counts),
+        "chunks": np.concatenate([np.arange(n, dtype=np.int32) for n in counts]),
+    }
+
+    # Preallocate the float32 buffer once; each slice assignment reads the
+    # memory-mapped float16 rows and upcasts them in place
+    vectors = np.empty((sum(counts), matrices[0].shape[1]), dtype=np.float32)
+    offsets = np.cumsum([0] + counts[:-1])
+
+    def fill(matrix, offset):
+        vectors[offset : offset + len(matrix)] = matrix
+
+    # Page-ins and the copy release the GIL, so documents load in parallel
+    if len(matrices) > 1:
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            list(executor.map(fill, matrices, offsets))
+    else:
+        fill(matrices[0], 0)
+    faiss.normalize_L2(vectors)
+
+    vectors, metadata = dedupeVectors(vectors, metadata)
+    index = createIndex(vectors)
     print(f"Index built with {index.ntotal} vectors")
+    return index, metadata
+
+
+def saveFaissIndex(index, metadata, index_dir):
+    """
+    Persist the FAISS index and its metadata to index_dir.
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    # Both files are written to temp files and renamed into place: loaded
+    # indexes memory-map index.faiss, and truncating it in place would
+    # crash (SIGBUS) any thread still searching the old mapping.
+    # The index goes first, so a new metadata file marks a complete save
+    fd, tmpPath = tempfile.mkstemp(dir=index_dir, suffix=".faiss.tmp")
+    os.close(fd)
+    faiss.write_index(index, tmpPath)
+    os.replace(tmpPath, os.path.join(index_dir, INDEX_FILE))
+
+    # Plain string/int arrays: loading needs no per-entry decoding or pickle
+    fd, tmpPath = tempfile.mkstemp(dir=index_dir, suffix=".npz.tmp")
+    with os.fdopen(fd, "wb") as f:
+        np.savez(f, files=metadata["files"], chunks=metadata["chunks"])
+    os.replace(tmpPath, os.path.join(index_dir, METADATA_FILE))
 
-    # Save the index and metadata
-    faiss.write_index(index, index_file)
-    with open(metadata_file, "w") as f:
-        json.dump(metadata, f)
 
+def loadFaissIndex(index_dir):
+    """
+    Load a FAISS index (memory-mapped where the index type supports it) and
+    its metadata from index_dir.
+    """
+    print(f"Loading existing index from {index_dir}")
+    with np.load(os.path.join(index_dir, METADATA_FILE)) as data:
+        metadata = {"files": data["files"], "chunks": data["chunks"]}
+
+    # IO_FLAG_MMAP only maps IVF inverted lists. The flat-code indexes used
+    # below IVFPQ_MIN_VECTORS (IndexScalarQuantizer, and the storage of
+    # IndexHNSWSQ) need IO_FLAG_MMAP_IFC (FAISS >= 1.9), otherwise their
+    # codes are read into memory. One vector per metadata row tells which.
+    indexFile = os.path.join(index_dir, INDEX_FILE)
+    if len(metadata["files"]) >= IVFPQ_MIN_VECTORS:
+        index = faiss.read_index(indexFile, faiss.IO_FLAG_MMAP)
+    elif hasattr(faiss, "IO_FLAG_MMAP_IFC"):
+        index = faiss.read_index(indexFile, faiss.IO_FLAG_MMAP_IFC)
+    else:
+        index = faiss.read_index(indexFile)
+    setSearchDefaults(index)
     return index, metadata
 
 
+def indexIsFresh(embeddingFolder, index_dir):
+    """
+    True if a saved index exists in index_dir and is newer than every
+    embedding matrix (and document added/removed) in embeddingFolder.
+    """
+    index_file = os.path.join(index_dir, INDEX_FILE)
+    metadata_file = os.path.join(index_dir, METADATA_FILE)
+    if not (os.path.exists(index_file) and os.path.exists(metadata_file)):
+        return False
+
+    newest = os.path.getmtime(embeddingFolder)
+    for fileName in os.listdir(embeddingFolder):
+        vectorFile = os.path.join(embeddingFolder, fileName, "vectors.npy")
+        if os.path.isfile(vectorFile):
+            newest = max(newest, os.path.getmtime(vectorFile))
+    # metadata is written after the index, so its mtime marks a complete save
+    return os.path.getmtime(metadata_file) >= newest
+
+
 def searchFaiss(index, queryVector, metadata, topK=3):
     """
     Search the FAISS index for the k most similar vectors to the query vector
-    Returns a list of (filename, chunkId, score)
+    Returns a list of (filename, chunkIndex, score) where score is cosine similarity
     """
-    queryVector = np.array([queryVector]).astype("float32")
-    distances, indices = index.search(queryVector, topK)
-    results = []
-    for dist, idx in zip(distances[0], indices[0]):
-        results.append((metadata[idx][0], metadata[idx][1], dist))
-    return results
+    # No copy when the query is already float32
+    query = np.ascontiguousarray(queryVector, dtype=np.float32).reshape(1, -1)
+    return searchFaissBatch(index, query, metadata, topK)[0]
+
+
+def searchFaissBatch(index, queryMatrix, metadata, topK=3):
+    """
+    Search the FAISS index for a (B, dim) matrix of query vectors with a
+    single index.search call (one matrix product instead of B).
+    Returns one list of (filename, chunkIndex, score) per query.
+    """
+    # Normalized in place; no copy when the queries are already float32
+    queries = np.ascontiguousarray(queryMatrix, dtype=np.float32)
+    faiss.normalize_L2(queries)
+    if 0 < index.ntotal < SMALL_INDEX_VECTORS:
+        scores, indices = searchSmall(decodedVectors(index), queries, topK)
+    elif hasattr(index, "hnsw") and topK > HNSW_EF_SEARCH:
+        # The search beam must be at least as wide as the number of results.
+        # Passed per call: the index is shared by concurrent searches
+        params = faiss.SearchParametersHNSW()
+        params.efSearch = topK
+        scores, indices = index.search(queries, topK, params=params)
+    else:
+        scores, indices = index.search(queries, topK)
+
+    # Gather every hit's metadata with one fancy-index per array. FAISS pads
+    # with -1 when the index holds fewer than topK vectors; those are dropped
+    found = indices >= 0
+    hits = np.where(found, indices, 0)
+    files = metadata["files"][hits].tolist()
+    chunks = metadata["chunks"][hits].tolist()
+    return [
+        [
+            (fileName, chunkIndex, score)
+            for fileName, chunkIndex, score, ok in zip(*row)
+            if ok
+        ]
+        for row in zip(files, chunks, scores.tolist(), found.tolist())
+    ]
+
+
+@functools.lru_cache(maxsize=32)
+def decodedVectors(index):
+    """
+    Decode the stored vectors of a small index to float32, once per index.
+    """
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def searchSmall(vectors, queries, topK):
+    """
+    Exact inner-product search over an in-memory (N, dim) matrix.
+    Returns (scores, indices) shaped like index.search, padded with -1.
+    """
+    n = len(vectors)
+    k = min(topK, n)
+    allScores = innerProducts(vectors, queries)
+    top = np.argpartition(-allScores, k - 1, axis=1)[:, :k]
+    topScores = np.take_along_axis(allScores, top, axis=1)
+    order = np.argsort(-topScores, axis=1)
+
+    scores = np.full((len(queries), topK), -np.inf, dtype=np.float32)
+    indices = np.full((len(queries), topK), -1, dtype=np.int64)
+    scores[:, :k] = np.take_along_axis(topScores, order, axis=1)
+    indices[:, :k] = np.take_along_axis(top, order, axis=1)
+    return scores, indices
+
+
+def innerProducts(vectors, queries):
+    """
+    (B, N) inner products of each query with each vector.
+    ||q - x||^2 = ||q||^2 + ||x||^2 - 2 q.x and every stored and query vector
+    is unit length, so ranking by q.x is L2 ranking with no norms to keep.
+    """
+    if njit is not None and len(queries) == 1:
+        return innerProductsJit(vectors, queries)
+    # A batch of queries is a single BLAS matrix product
+    return queries @ vectors.T
+
+
+if njit is not None:
+
+    @njit(parallel=True, fastmath=True, cache=True)
+    def innerProductsJit(vectors, queries):
+        n, dim = vectors.shape
+        out = np.empty((queries.shape[0], n), dtype=np.float32)
+        for i in prange(n):
+            for q in range(queries.shape[0]):
+                s = 0.0
+                for j in range(dim):
+                    s += vectors[i, j] * queries[q, j]
+                out[q, i] = s
+        return out
 
 
 if __name__ == "__main__":
@@ -74,6 +388,6 @@ if __name__ == "__main__":
     from src.embed import createEmbedding
 
     testVector = createEmbedding("This system avoids hallucinations.")
-    index, metadata = buildFaissIndex("embedding")
+    index, metadata = buildFaissIndex("embeddings")
     results = searchFaiss(index, testVector, metadata)
     print("Top results", results)
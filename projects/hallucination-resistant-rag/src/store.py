@@ -0,0 +1,128 @@
+import errno
+import os
+import shutil
+import time
+import uuid
+from pathlib import Path
+
+# Get the project root directory (parent of src/)
+PROJECT_ROOT = Path(__file__).parent.parent
+
+# Content-addressed store: data/embeddings/<sha256 of PDF>/ holds vectors.npy,
+# chunks.json and meta.json, shared by every corpus that contains that PDF
+EMBEDDINGS_STORE = PROJECT_ROOT / "data" / "embeddings"
+
+# Corpora reference store entries through <embeddings root>/<file name> links
+DEFAULT_EMBEDDINGS_ROOT = PROJECT_ROOT / "embeddings"
+SESSIONS_ROOT = PROJECT_ROOT / "data" / "sessions"
+
+# Entries younger than this may still be being written (unpublished) or be
+# about to be linked (published), so pruneStore leaves them alone
+TEMP_ENTRY_MAX_AGE = 3600
+
+
+def newStoreEntry(sha):
+    """
+    Create a private directory to write a store entry into before publishing.
+    """
+    entryDir = EMBEDDINGS_STORE / f".tmp-{sha}-{uuid.uuid4().hex}"
+    entryDir.mkdir(parents=True)
+    return entryDir
+
+
+def publishStoreEntry(entryDir, sha):
+    """
+    Atomically move a fully written entry to EMBEDDINGS_STORE/<sha>, so readers
+    never see a half-written vectors.npy. If another upload of the same PDF
+    published first, its entry is kept and this one discarded.
+    """
+    target = EMBEDDINGS_STORE / sha
+    if target.is_dir() and not (target / "chunks.json").exists():
+        # incomplete entry left behind by an interrupted write
+        shutil.rmtree(target, ignore_errors=True)
+    try:
+        os.rename(entryDir, target)
+    except OSError:
+        shutil.rmtree(entryDir, ignore_errors=True)
+
+
+def linkEmbeddings(link, target):
+    """
+    Point embeddings_root/<file name> at its content-addressed store directory,
+    copying instead where the platform does not allow symlinks.
+    Safe to call concurrently for the same link: an existing correct link is
+    kept, and a new one is swapped in with a single rename.
+    """
+    relativeTarget = os.path.relpath(target, link.parent)
+    try:
+        if os.readlink(link) == relativeTarget:
+            return
+    except OSError:
+        pass  # missing, or not a symlink
+
+    tmpLink = link.with_name(f".tmp-{link.name}-{uuid.uuid4().hex}")
+    try:
+        os.symlink(relativeTarget, tmpLink, target_is_directory=True)
+    except (OSError, NotImplementedError) as e:
+        if not symlinksUnsupported(e):
+            raise
+        shutil.rmtree(link, ignore_errors=True)
+        shutil.copytree(target, link, dirs_exist_ok=True)
+        return
+
+    # A rename cannot replace a directory (copied entry or old layout)
+    if link.is_dir() and not link.is_symlink():
+        shutil.rmtree(link, ignore_errors=True)
+    os.replace(tmpLink, link)
+
+
+def symlinksUnsupported(error):
+    """
+    True if os.symlink failed because the platform or filesystem has no
+    symlinks (or, on Windows, the process may not create them).
+    """
+    if isinstance(error, NotImplementedError):
+        return True
+    # ERROR_PRIVILEGE_NOT_HELD
+    if getattr(error, "winerror", None) == 1314:
+        return True
+    return error.errno in (errno.EPERM, errno.ENOSYS, errno.EOPNOTSUPP)
+
+
+def linkedEntries():
+    """
+    Resolved paths of the store entries that any corpus still links to.
+    """
+    roots = [DEFAULT_EMBEDDINGS_ROOT]
+    if SESSIONS_ROOT.is_dir():
+        roots.extend(session / "embeddings" for session in SESSIONS_ROOT.iterdir())
+
+    linked = set()
+    for root in roots:
+        if not root.is_dir():
+            continue
+        for link in root.iterdir():
+            if link.is_symlink():
+                linked.add(os.path.realpath(link))
+    return linked
+
+
+def pruneStore():
+    """
+    Delete store entries that no corpus links to anymore (deleted sessions,
+    replaced documents) and abandoned unpublished entries, once they are
+    older than TEMP_ENTRY_MAX_AGE.
+    """
+    if not EMBEDDINGS_STORE.is_dir():
+        return
+
+    linked = linkedEntries()
+    cutoff = time.time() - TEMP_ENTRY_MAX_AGE
+    for entry in EMBEDDINGS_STORE.iterdir():
+        try:
+            if entry.stat().st_mtime >= cutoff:
+                continue
+        except FileNotFoundError:
+            continue  # published or pruned meanwhile
+        if entry.name.startswith(".tmp-") or os.path.realpath(entry) not in linked:
+            shutil.rmtree(entry, ignore_errors=True)
@@ -1,15 +1,24 @@
+import io
 import shutil
+import tempfile
 import uuid
 from pathlib import Path
 from fastapi import UploadFile, HTTPException
+from fastapi.concurrency import run_in_threadpool
 import os
 
-SESSIONS_DIR = Path("data/sessions")
+from src.store import SESSIONS_ROOT, pruneStore
+
+# Same directory main.getPaths reads sessions from, whatever the cwd
+SESSIONS_DIR = SESSIONS_ROOT
 SESSIONS_DIR.mkdir(parents=True, exist_ok=True)
 
 # Maximum file size: 50 MB
 MAX_FILE_SIZE = 50 * 1024 * 1024
 
+# Copy uploads in 4 MB blocks rather than shutil's default 64 KB
+COPY_BUFFER_SIZE = 4 * 1024 * 1024
+
 
 def validatePdfFile(file: UploadFile) -> None:
     """Validate the uploaded file is a proper PDF."""
@@ -40,24 +49,54 @@ async def saveUploadedPdf(file: UploadFile, session_id: str = None) -> (str, str
     file_path = session_dir / "uploads" / file.filename
     file_path.parent.mkdir(parents=True, exist_ok=True)
 
-    # Check if file already exists
+    # Keep both copies of a re-uploaded name with one random suffix
     if file_path.exists():
-        base_name = file_path.stem
-        extension = file_path.suffix
-        counter = 1
-        while file_path.exists():
-            file_path = file_path.parent / f"{base_name}_{counter}{extension}"
-            counter += 1
+        file_path = file_path.with_stem(f"{file_path.stem}_{uuid.uuid4().hex[:8]}")
 
     try:
-        with file_path.open("wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        # Copy off the event loop so one large upload does not stall the server
+        await run_in_threadpool(writeUpload, file.file, file_path)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to save file: {str(e)}")
 
     return session_id, str(file_path)
 
 
+def writeUpload(source, file_path: Path) -> None:
+    """Write an uploaded file's contents to file_path."""
+    with open(file_path, "wb") as buffer:
+        copyUpload(source, buffer)
+
+
+def copyUpload(source, destination) -> None:
+    """
+    Copy an uploaded file, letting the kernel move the bytes with os.sendfile
+    when the upload is already backed by a real file.
+    """
+    # fileno() would force an in-memory spooled upload out to disk first.
+    # SpooledTemporaryFile has no public "rolled over" flag; its private _file
+    # stays an io.BytesIO until the upload is written to disk
+    inMemory = isinstance(source, tempfile.SpooledTemporaryFile) and isinstance(
+        getattr(source, "_file", None), io.BytesIO
+    )
+    if hasattr(os, "sendfile") and not inMemory:
+        # sendfile with an explicit offset leaves the source position alone,
+        # so a failed attempt only needs the destination reset
+        try:
+            sourceFd, destinationFd = source.fileno(), destination.fileno()
+            offset = source.tell()
+            while True:
+                sent = os.sendfile(destinationFd, sourceFd, offset, COPY_BUFFER_SIZE)
+                if sent == 0:
+                    return
+                offset += sent
+        except (AttributeError, OSError, ValueError):
+            destination.seek(0)
+            destination.truncate()
+
+    shutil.copyfileobj(source, destination, length=COPY_BUFFER_SIZE)
+
+
 def getSessionFiles(session_id: str) -> list:
     """Get list of files uploaded in a session."""
     session_dir = SESSIONS_DIR / session_id / "uploads"
@@ -68,9 +107,14 @@ def getSessionFiles(session_id: str) -> list:
 
 
 def deleteSession(session_id: str) -> bool:
-    """Delete a session and all its files."""
+    """
+    Delete a session and all its files. Stored embeddings and chunks of its
+    documents that no other session shares are pruned once they are older
+    than store.TEMP_ENTRY_MAX_AGE.
+    """
     session_dir = SESSIONS_DIR / session_id
     if session_dir.exists():
         shutil.rmtree(session_dir)
+        pruneStore()
         return True
     return False
@@ -0,0 +1,97 @@
+import asyncio
+import threading
+
+import pytest
+
+from src.batching import QueryBatcher, batchLoop
+
+
+async def runBatchLoop(handler, scenario):
+    queue = asyncio.Queue()
+    loopTask = asyncio.create_task(batchLoop(queue, handler, 0.01, 32))
+
+    async def submit(item):
+        future = asyncio.get_running_loop().create_future()
+        await queue.put((item, future))
+        return future
+
+    try:
+        return await scenario(submit)
+    finally:
+        loopTask.cancel()
+
+
+def test_batch_loop_survives_cancelled_waiter():
+    # Created inside asyncio.run: before Python 3.10 an Event binds to the
+    # loop current at creation
+    state = {}
+    handled = []
+
+    async def handler(items):
+        await state["release"].wait()
+        handled.append(items)
+        return [item * 2 for item in items]
+
+    async def scenario(submit):
+        state["release"] = asyncio.Event()
+        abandoned = await submit(1)
+        await asyncio.sleep(0.05)  # batch is now waiting in the handler
+        abandoned.cancel()
+        state["release"].set()
+        return await asyncio.wait_for(await submit(2), timeout=1)
+
+    assert asyncio.run(runBatchLoop(handler, scenario)) == 4
+    # the cancelled waiter's batch really was resolved, not failed
+    assert handled == [[1], [2]]
+
+
+def test_batch_loop_survives_handler_error():
+    calls = []
+
+    async def handler(items):
+        calls.append(items)
+        if len(calls) == 1:
+            raise RuntimeError("search failed")
+        return items
+
+    async def scenario(submit):
+        failed = await submit("a")
+        with pytest.raises(RuntimeError):
+            await asyncio.wait_for(failed, timeout=1)
+        return await asyncio.wait_for(await submit("b"), timeout=1)
+
+    assert asyncio.run(runBatchLoop(handler, scenario)) == "b"
+
+
+def test_batch_loop_coalesces_concurrent_requests():
+    batches = []
+
+    async def handler(items):
+        batches.append(items)
+        return items
+
+    async def scenario(submit):
+        futures = [await submit(i) for i in range(5)]
+        return await asyncio.wait_for(asyncio.gather(*futures), timeout=1)
+
+    assert asyncio.run(runBatchLoop(handler, scenario)) == [0, 1, 2, 3, 4]
+    assert batches == [[0, 1, 2, 3, 4]]
+
+
+def test_query_batcher_survives_cancelled_waiter():
+    started = threading.Event()
+    release = threading.Event()
+
+    def encode(texts):
+        started.set()
+        release.wait()
+        return [text.upper() for text in texts]
+
+    batcher = QueryBatcher(encode, timeout_ms=1)
+    abandoned = batcher.submitAsync("first")
+    assert started.wait(timeout=1)
+    # Still pending from the caller's side, so cancelling it succeeds
+    assert abandoned.cancel()
+    release.set()
+
+    assert batcher.submitAsync("second").result(timeout=1) == "SECOND"
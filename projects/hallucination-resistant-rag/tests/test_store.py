@@ -0,0 +1,66 @@
+import os
+import threading
+import time
+
+import src.store
+from src.store import linkEmbeddings, pruneStore
+
+
+def test_link_embeddings_is_idempotent_under_concurrency(tmp_path):
+    target = tmp_path / "store" / "abc"
+    target.mkdir(parents=True)
+    (target / "chunks.json").write_text("[]")
+    root = tmp_path / "embeddings"
+    root.mkdir()
+    link = root / "doc.pdf"
+
+    errors = []
+
+    def link_once():
+        try:
+            linkEmbeddings(link, target)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=link_once) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert os.path.realpath(link) == os.path.realpath(target)
+    assert os.listdir(root) == ["doc.pdf"]
+
+
+def test_link_embeddings_replaces_old_layout_directory(tmp_path):
+    target = tmp_path / "store" / "abc"
+    target.mkdir(parents=True)
+    root = tmp_path / "embeddings"
+    link = root / "doc.pdf"
+    link.mkdir(parents=True)
+    (link / "chunk_0.npy").write_bytes(b"")
+
+    linkEmbeddings(link, target)
+
+    assert link.is_symlink()
+    assert os.path.realpath(link) == os.path.realpath(target)
+
+
+def test_prune_store_keeps_young_unlinked_entries(tmp_path, monkeypatch):
+    store = tmp_path / "store"
+    monkeypatch.setattr(src.store, "EMBEDDINGS_STORE", store)
+    monkeypatch.setattr(src.store, "DEFAULT_EMBEDDINGS_ROOT", tmp_path / "embeddings")
+    monkeypatch.setattr(src.store, "SESSIONS_ROOT", tmp_path / "sessions")
+
+    young = store / "young"
+    old = store / "old"
+    young.mkdir(parents=True)
+    old.mkdir()
+    cutoff = time.time() - src.store.TEMP_ENTRY_MAX_AGE
+    os.utime(old, (cutoff - 60, cutoff - 60))
+
+    pruneStore()
+
+    assert young.is_dir()
+    assert not old.exists()
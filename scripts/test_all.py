@@ -1,46 +1,244 @@
-"""Run all tests across all projects."""
+"""
+Run all tests across all projects.
 
+Projects run in parallel, one pytest process each; pass --serial to run
+them one after another. With pytest-xdist installed, each project's tests
+are also spread over worker processes unless --no-xdist is given.
+
+--in-process runs the projects one after another with pytest.main inside
+this interpreter instead, skipping a Python and plugin start-up per project.
+
+--fast is for the edit/test loop: previously failing tests run first and
+each project stops at its first failure.
+
+--exitfirst (-x) stops at the first failing project, killing the pytest
+runs still in progress.
+
+--coverage measures coverage of every project's src/ and prints one
+combined report (also written to coverage.xml); it is ignored with --fast.
+"""
+
+import importlib.util
+import json
+import os
+import signal
 import subprocess
 import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
+# Last run time of each project, used to start the slowest projects first
+TIMINGS_FILE = Path(".test_all_timings.json")
+
 
 def find_test_directories():
     """Find all test directories in the monorepo."""
-    projects_dir = Path("projects")
     test_dirs = []
 
-    if projects_dir.exists():
-        for project_dir in projects_dir.iterdir():
-            if project_dir.is_dir():
-                test_dir = project_dir / "tests"
-                if test_dir.exists():
-                    test_dirs.append(test_dir)
+    # scandir's entries carry the file type, so only tests/ needs a stat
+    try:
+        with os.scandir("projects") as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    test_dir = Path(entry.path) / "tests"
+                    if test_dir.is_dir():
+                        test_dirs.append(test_dir)
+    except FileNotFoundError:
+        pass
 
     return test_dirs
 
 
-def run_tests(test_dir: Path, verbose: bool = False):
-    """Run tests in a specific directory."""
-    print(f"\n{'=' * 60}")
-    print(f"Testing: {test_dir.parent.name}")
-    print("=" * 60)
-
-    cmd = ["pytest", str(test_dir)]
+def pytest_args(
+    test_dir: Path,
+    verbose: bool = False,
+    xdist_workers: str = None,
+    fast: bool = False,
+    coverage: bool = False,
+):
+    """
+    Build the pytest arguments and environment overrides for one project.
+    xdist_workers is passed to pytest-xdist's -n; None runs in one process.
+    fast runs last-failed tests first and stops at the first failure.
+    coverage records coverage of the project's src/ to .coverage.<project>
+    for main() to combine.
+    """
+    args = [str(test_dir)]
 
     if verbose:
-        cmd.append("-v")
+        args.append("-v")
+
+    if xdist_workers:
+        # loadfile keeps each module on one worker so fixtures are set up once
+        args.extend(["-n", xdist_workers, "--dist=loadfile"])
+
+    if fast:
+        cache_dir = test_dir.parent / ".pytest_cache"
+        args.extend(["--ff", "-x", "--cache-dir", str(cache_dir)])
+
+    # Ignore PYTEST_ADDOPTS from the environment so runs stay reproducible
+    env = {"PYTEST_ADDOPTS": ""}
+
+    if coverage:
+        # Each project writes its own data file; the report comes from the
+        # combined data once every project has finished
+        args.extend(["--cov", str(test_dir.parent / "src"), "--cov-report="])
+        env["COVERAGE_FILE"] = f".coverage.{test_dir.parent.name}"
+
+    return args, env
+
+
+class ProcessTracker:
+    """
+    Tracks the running pytest processes so --exitfirst can stop them all.
+    Each one runs in its own session, so killing its process group also
+    stops any pytest-xdist workers it started.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.processes = set()
+        self.stopped = False
+
+    def start(self, cmd, env):
+        """Start cmd, or return None once stop_all has been called."""
+        with self.lock:
+            if self.stopped:
+                return None
+            process = subprocess.Popen(
+                cmd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                text=True,
+                env=env,
+                start_new_session=True,
+            )
+            self.processes.add(process)
+            return process
+
+    def finish(self, process):
+        with self.lock:
+            self.processes.discard(process)
+
+    def stop_all(self):
+        """Terminate every running process and refuse to start new ones."""
+        with self.lock:
+            self.stopped = True
+            for process in self.processes:
+                try:
+                    if hasattr(os, "killpg"):
+                        os.killpg(process.pid, signal.SIGTERM)
+                    else:
+                        process.terminate()
+                except ProcessLookupError:
+                    pass
+
+
+def run_tests(test_dir: Path, *options, tracker: ProcessTracker = None):
+    """
+    Run tests in a specific directory in its own pytest process.
+    options are passed on to pytest_args.
+    Returns (passed, output) with pytest's output captured so parallel runs
+    can be printed one project at a time.
+    """
+    args, env = pytest_args(test_dir, *options)
+    env = {**os.environ, **env}
+    if tracker is None:
+        result = subprocess.run(
+            ["pytest"] + args, capture_output=True, text=True, env=env
+        )
+        return result.returncode == 0, result.stdout + result.stderr
+
+    process = tracker.start(["pytest"] + args, env)
+    if process is None:
+        return False, "Cancelled.\n"
+    try:
+        output = process.communicate()[0]
+    finally:
+        tracker.finish(process)
+    return process.returncode == 0, output
+
 
-    # Add coverage if available
-    cmd.extend(["--cov", str(test_dir.parent / "src"), "--cov-report", "term-missing"])
+def run_tests_in_process(test_dir: Path, *options):
+    """
+    Run tests in a specific directory with pytest.main in this interpreter,
+    so pytest and its plugins are only imported once for all projects.
+    Every project has its own top-level src and tests packages, so modules
+    imported from the project are dropped again afterwards.
+    Returns whether the tests passed; output goes straight to the terminal.
+    """
+    import pytest
 
-    result = subprocess.run(cmd)
-    return result.returncode == 0
+    args, env = pytest_args(test_dir, *options)
+    project_dir = str(test_dir.parent.resolve())
+    saved_path, saved_env = list(sys.path), dict(os.environ)
+    os.environ.update(env)
+    try:
+        return pytest.main(args) == 0
+    finally:
+        sys.path[:] = saved_path
+        os.environ.clear()
+        os.environ.update(saved_env)
+        for name, module in list(sys.modules.items()):
+            module_file = getattr(module, "__file__", None) or ""
+            # the separator keeps e.g. projects/rag from matching projects/rag-eval
+            if module_file.startswith(project_dir + os.sep):
+                del sys.modules[name]
+
+
+def timed(func, *args, **kwargs):
+    """Call func(*args, **kwargs) and return (result, seconds taken)."""
+    start = time.monotonic()
+    result = func(*args, **kwargs)
+    return result, time.monotonic() - start
+
+
+def load_timings() -> dict:
+    """Load the per-project durations saved by the previous run."""
+    try:
+        return json.loads(TIMINGS_FILE.read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def save_timings(timings: dict):
+    """Write the timings atomically so an interrupted run cannot corrupt them."""
+    fd, tmp_path = tempfile.mkstemp(dir=TIMINGS_FILE.parent, suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(timings, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, TIMINGS_FILE)
+
+
+def print_project_output(project_name: str, output: str):
+    """Print one project's captured test output as a single block."""
+    print(f"\n{'=' * 60}")
+    print(f"Testing: {project_name}")
+    print("=" * 60)
+    print(output, end="")
+
+
+def report_coverage():
+    """Combine the per-project coverage data and print one report."""
+    print(f"\n{'=' * 60}")
+    print("Coverage")
+    print("=" * 60)
+    subprocess.run(["coverage", "combine"])
+    subprocess.run(["coverage", "report", "-m"])
+    subprocess.run(["coverage", "xml", "-q"])
 
 
 def main():
     """Run all tests."""
     verbose = "-v" in sys.argv or "--verbose" in sys.argv
+    in_process = "--in-process" in sys.argv
+    serial = "--serial" in sys.argv or in_process
+    fast = "--fast" in sys.argv
+    exitfirst = "--exitfirst" in sys.argv or "-x" in sys.argv
+    coverage = "--coverage" in sys.argv and not fast
+    use_xdist = "--no-xdist" not in sys.argv and importlib.util.find_spec("xdist")
 
     print("=" * 60)
     print("Running Tests for All Projects")
@@ -52,10 +250,68 @@ def main():
         print("No test directories found.")
         return
 
+    # Longest first keeps one slow project from starting last and setting
+    # the total run time; projects without a timing are assumed slow
+    timings = load_timings()
+    test_dirs.sort(key=lambda td: -timings.get(td.parent.name, float("inf")))
+
+    # Leave two cores free so the machine stays responsive
+    max_workers = max(1, (os.cpu_count() or 4) - 2)
+
     results = {}
-    for test_dir in test_dirs:
-        project_name = test_dir.parent.name
-        results[project_name] = run_tests(test_dir, verbose)
+    if serial:
+        # In-process runs exist to avoid extra interpreters; xdist would
+        # start a worker process per core for every project again
+        xdist_workers = "auto" if use_xdist and not in_process else None
+        for test_dir in test_dirs:
+            project_name = test_dir.parent.name
+            options = (verbose, xdist_workers, fast, coverage)
+            if in_process:
+                print_project_output(project_name, "")
+                results[project_name], duration = timed(
+                    run_tests_in_process, test_dir, *options
+                )
+            else:
+                (results[project_name], output), duration = timed(
+                    run_tests, test_dir, *options
+                )
+                print_project_output(project_name, output)
+            timings[project_name] = duration
+            if exitfirst and not results[project_name]:
+                break
+    else:
+        # Split the cores between the projects running side by side
+        per_project = max_workers // len(test_dirs)
+        xdist_workers = str(per_project) if use_xdist and per_project > 1 else None
+        options = (verbose, xdist_workers, fast, coverage)
+        # Threads are enough since each one only waits on its pytest process,
+        # and they let the tracker reach every running process. Tracked
+        # processes get their own session, out of reach of the terminal's
+        # Ctrl-C, so only --exitfirst uses the tracker.
+        tracker = ProcessTracker() if exitfirst else None
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(
+                    timed, run_tests, test_dir, *options, tracker=tracker
+                ): test_dir.parent.name
+                for test_dir in test_dirs
+            }
+            for future in as_completed(futures):
+                project_name = futures[future]
+                (results[project_name], output), duration = future.result()
+                timings[project_name] = duration
+                print_project_output(project_name, output)
+                if tracker and not results[project_name]:
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    tracker.stop_all()
+                    break
+
+    # --fast stops at the first failure, so its durations are not representative
+    if not fast:
+        save_timings(timings)
+
+    if coverage:
+        report_coverage()
 
     # Summary
     print("\n" + "=" * 60)
@@ -63,7 +319,13 @@ def main():
     print("=" * 60)
 
     all_passed = True
-    for project_name, passed in results.items():
+    for test_dir in test_dirs:
+        project_name = test_dir.parent.name
+        if project_name not in results:
+            # stopped by --exitfirst before finishing
+            print(f"{project_name}: - CANCELLED")
+            continue
+        passed = results[project_name]
         status = "✓ PASSED" if passed else "✗ FAILED"
         print(f"{project_name}: {status}")
         if not passed: